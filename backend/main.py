@@ -3,45 +3,50 @@ import os
 import uvicorn
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field, field_validator
-from typing import Optional, Dict, Any
+from fastapi.responses import ORJSONResponse
+import msgspec
+from typing import Annotated, Optional, Dict, Any
 from dotenv import load_dotenv
 import time
 import logging
-from concurrent.futures import ThreadPoolExecutor
-import asyncio
 
 # Load environment variables
 load_dotenv()
 
-from regret_model import classify_regret
+from regret_model import classify_regret_async
 
-# Create a thread pool executor for running blocking operations
-# This allows multiple concurrent requests to be processed in parallel
-executor = ThreadPoolExecutor(max_workers=10)
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Attach one shared handler at the root so records from every backend
+# module (main, regret_model, ...) are emitted with the same format;
+# per-record cost stays low via %s lazy formatting and DEBUG-level
+# hot-path lines
+_root_logger = logging.getLogger()
+_root_logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+if not _root_logger.handlers:
+    # Guard like basicConfig does: this module runs twice when launched as
+    # __main__ and re-imported via the "main:app" import string, and a
+    # second handler would duplicate every log line
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(
+        logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    )
+    _root_logger.addHandler(_log_handler)
 logger = logging.getLogger(__name__)
 
-class ClassifyRequest(BaseModel):
-    typed_text: str = Field(..., min_length=1, max_length=10000, description="Text to classify")
-    url: Optional[str] = Field(None, max_length=2048, description="URL where text was typed")
-    time_iso: Optional[str] = Field(None, description="ISO timestamp")
-    context: Optional[Dict[str, Any]] = Field(None, description="Additional context")
-    
-    @field_validator('typed_text')
-    @classmethod
-    def validate_text(cls, v: str) -> str:
-        if not v or not v.strip():
-            raise ValueError("typed_text cannot be empty")
-        return v.strip()
+# msgspec decodes and validates the payload in a single C-implemented pass,
+# avoiding Pydantic's per-request model construction overhead
+class ClassifyRequest(msgspec.Struct):
+    typed_text: Annotated[str, msgspec.Meta(min_length=1, max_length=10000)]
+    url: Optional[Annotated[str, msgspec.Meta(max_length=2048)]] = None
+    time_iso: Optional[str] = None
+    context: Optional[Dict[str, Any]] = None
+
+_classify_decoder = msgspec.json.Decoder(ClassifyRequest)
 
-app = FastAPI(title="RegretGPT API", version="1.0.0")
+app = FastAPI(
+    title="RegretGPT API",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+)
 
 # CORS configuration - restrict to localhost in development, configure for production
 allowed_origins = os.getenv("ALLOWED_ORIGINS", "http://localhost:8000,http://127.0.0.1:8000").split(",")
@@ -61,14 +66,30 @@ app.add_middleware(
     max_age=3600,
 )
 
-# Request timeout middleware
-@app.middleware("http")
-async def timeout_middleware(request: Request, call_next):
-    start_time = time.time()
-    response = await call_next(request)
-    process_time = time.time() - start_time
-    response.headers["X-Process-Time"] = str(process_time)
-    return response
+# Request timing middleware (pure ASGI - avoids BaseHTTPMiddleware's
+# per-request task and memory-stream overhead)
+class TimingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                process_time = time.perf_counter() - start
+                message["headers"].append(
+                    (b"x-process-time", f"{process_time}".encode())
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+app.add_middleware(TimingMiddleware)
 
 @app.get("/health")
 async def health():
@@ -80,37 +101,44 @@ async def health():
     }
 
 @app.post("/classify")
-async def classify(req: ClassifyRequest):
+async def classify(request: Request):
     """
     Classify text for regret potential.
-    
+
     Returns a regret score (0-100) and intervention recommendations.
-    
+
     This endpoint can handle multiple concurrent requests from different users and browsers.
-    The blocking Gemini API calls are executed in a thread pool to maintain concurrency.
+    The Gemini API calls are fully async, so concurrent requests share the event loop.
     """
+    body = await request.body()
     try:
-        logger.info(f"Classifying text (length: {len(req.typed_text)}) from {req.url}")
-        
-        # Additional validation
-        if len(req.typed_text) > 10000:
-            raise ValueError("Text exceeds maximum length of 10000 characters")
-        
-        # Run the blocking classify_regret function in a thread pool
-        # This allows multiple requests to be processed concurrently
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(executor, classify_regret, req.model_dump())
+        req = _classify_decoder.decode(body)
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid request body: {e}")
+
+    try:
+        typed_text = req.typed_text.strip()
+        if not typed_text:
+            raise ValueError("typed_text cannot be empty")
+
+        # Per-request logs are DEBUG with %s lazy formatting so they cost
+        # nothing at the default INFO level
+        logger.debug("Classifying text length=%d url=%s", len(typed_text), req.url)
+
+        payload = msgspec.to_builtins(req)
+        payload["typed_text"] = typed_text
+        result = await classify_regret_async(payload)
         
         # Validate result structure
         if not isinstance(result.get("regret_score"), int):
             raise ValueError("Invalid regret_score in response")
         
-        logger.info(f"Classification complete: score={result.get('regret_score')}")
+        logger.debug("Classification complete: score=%s", result.get("regret_score"))
         return result
         
     except ValueError as e:
-        logger.warning(f"Validation error: {e}")
-        return JSONResponse(
+        logger.warning("Validation error: %s", e)
+        return ORJSONResponse(
             status_code=400,
             content={
                 "regret_score": 0,
@@ -121,9 +149,9 @@ async def classify(req: ClassifyRequest):
             }
         )
     except Exception as e:
-        logger.error(f"Error in classify endpoint: {e}", exc_info=True)
+        logger.error("Error in classify endpoint: %s", e, exc_info=True)
         # Return a safe default response instead of crashing
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=500,
             content={
                 "regret_score": 0,
@@ -137,14 +165,18 @@ async def classify(req: ClassifyRequest):
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8000))
     host = os.getenv("HOST", "0.0.0.0")
-    workers = int(os.getenv("WORKERS", 1))  # Number of worker processes (1 for development, 4+ for production)
-    logger.info(f"Starting RegretGPT backend on {host}:{port} with {workers} worker(s)")
+    workers = int(os.getenv("WEB_CONCURRENCY", 4))  # Number of worker processes
+    logger.info("Starting RegretGPT backend on %s:%d with %d worker(s)", host, port, workers)
     logger.info("Backend is configured to handle multiple concurrent requests from different users and browsers")
+    # Import string (not the app object) enables multi-worker mode; uvloop +
+    # httptools replace the pure-Python event loop and h11 parser
     uvicorn.run(
-        app,
+        "main:app",
         host=host,
         port=port,
         log_level="info",
+        loop="uvloop",
+        http="httptools",
         timeout_keep_alive=30,
-        workers=workers if workers > 1 else None  # Use multiple workers in production
+        workers=workers,
     )
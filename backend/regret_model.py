@@ -2,29 +2,97 @@
 import os
 import json
 import re
-from datetime import datetime
+import time
+import asyncio
+import hashlib
+import logging
+import orjson
+import ciso8601
+from functools import lru_cache
 from typing import Dict, Any
+from urllib.parse import urlparse
+from cachetools import TTLCache
 from dotenv import load_dotenv
+from tenacity import (
+  AsyncRetrying,
+  retry_if_exception,
+  stop_after_attempt,
+  wait_exponential_jitter,
+)
 
 # Load environment variables
 load_dotenv()
 
 import google.generativeai as genai
 
+# Error classification: prefer O(1) isinstance checks on the google.api_core
+# exception types; the compiled patterns catch wrapped or stringified errors.
+try:
+  from google.api_core import exceptions as gapi_exceptions
+  _NOT_FOUND_EXCEPTIONS = (gapi_exceptions.NotFound, gapi_exceptions.MethodNotImplemented)
+  _RATE_LIMIT_EXCEPTIONS = (gapi_exceptions.ResourceExhausted, gapi_exceptions.TooManyRequests)
+except ImportError:
+  _NOT_FOUND_EXCEPTIONS = ()
+  _RATE_LIMIT_EXCEPTIONS = ()
+
+_NOT_FOUND_RE = re.compile(r"404|not found|not supported", re.I)
+_RATE_LIMIT_RE = re.compile(r"429|quota|rate limit", re.I)
+
+def _is_not_found_error(e):
+  return isinstance(e, _NOT_FOUND_EXCEPTIONS) or bool(_NOT_FOUND_RE.search(str(e)))
+
+def _is_rate_limit_error(e):
+  return isinstance(e, _RATE_LIMIT_EXCEPTIONS) or bool(_RATE_LIMIT_RE.search(str(e)))
+
+def _is_retryable_error(e):
+  # A missing model never fixes itself mid-request; everything else
+  # (rate limits, transient 5xx) is worth retrying with backoff
+  return not _is_not_found_error(e)
+
+_MAX_RETRIES = 3
+
+# Back-pressure ceiling: cap in-flight Gemini calls so a burst of traffic
+# queues briefly instead of stampeding the API into 429s (which would then
+# cascade through the retry path)
+_GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "16"))
+_gemini_semaphore = asyncio.Semaphore(_GEMINI_CONCURRENCY)
+
 api_key = os.getenv("GEMINI_API_KEY")
 if not api_key:
     raise ValueError("GEMINI_API_KEY environment variable is not set. Please set it in your .env file or environment.")
 
 genai.configure(api_key=api_key)
 
-# List of model names to try in order
-AVAILABLE_MODELS = [
-    "gemma-3-27b-it",
-    "gemma-3-27b-instruct",
-    "gemini-2.5-flash"  # Fallback
-]
+logger = logging.getLogger(__name__)
+
+# Bounded retry logging: under a rate-limit storm every attempt would
+# otherwise emit its own line, flushing stdout/stderr while holding the
+# GIL. Allow at most one retry log per second per model.
+_RETRY_LOG_INTERVAL = 1.0
+_last_retry_log = {}
+
+def _log_retry(model_name, message, *args):
+  now = time.monotonic()
+  if now - _last_retry_log.get(model_name, 0.0) >= _RETRY_LOG_INTERVAL:
+    _last_retry_log[model_name] = now
+    logger.warning(message, *args)
+
+def _make_retry_logger(model_name):
+  """tenacity before_sleep hook bound to one model's rate-limited logger."""
+  def _before_sleep(retry_state):
+    e = retry_state.outcome.exception()
+    if _is_rate_limit_error(e):
+      _log_retry(model_name, "Rate limited on %s (attempt %d), backing off...",
+                 model_name, retry_state.attempt_number)
+    else:
+      _log_retry(model_name, "Error on %s (attempt %d/%d): %s, retrying...",
+                 model_name, retry_state.attempt_number, _MAX_RETRIES, e)
+  return _before_sleep
+
+from prompts import AVAILABLE_MODELS, REGRET_SYSTEM_PROMPT
 
-# Cache the working model name
+# Cache the working model name so we keep using whichever model first
+# succeeded instead of walking the fallback list every request
 _cached_model_name = None
 
 def get_available_model():
@@ -35,53 +103,487 @@ def get_available_model():
     # Default to gemma-3-27b-it, will be updated on first successful call
     return "gemma-3-27b-it"
 
-REGRET_SYSTEM_PROMPT = """
-You are RegretGPT, an assistant that predicts whether a user will regret an action within the next 24 hours.
-You are blunt, sarcastic, and slightly toxic, but not abusive.
-
-Given:
-- The website URL
-- The current time (interpret as Singapore time if timezone unclear)
-- What the user is typing
-- A brief context label (like 'messaging', 'email', 'finance')
-
-You must:
-1. Return a "regret_score" from 0 to 100, where:
-   - 0–20: very safe
-   - 20–50: mildly risky
-   - 50–80: risky
-   - 80–100: extremely regretful
-2. Explain in one sentence why.
-3. Decide an "intervention_strength" as one of:
-   - "NONE" (no popup)
-   - "WARN" (light warning popup)
-   - "PUZZLE" (require puzzle before proceeding)
-   - "BLOCK_HARD" (strongly discourage and gate behind puzzle)
-4. Craft a short, snarky one-liner "llm_message" (max 1 sentence).
-5. Optionally simulate a short "future_regret_simulation" (1–3 short sentences) describing how the user might feel later.
-
-Return a JSON object with keys:
-- regret_score (int)
-- reason (string)
-- intervention_strength (string)
-- llm_message (string)
-- future_regret_simulation (string)
-"""
-
-def classify_regret(payload: Dict[str, Any]) -> Dict[str, Any]:
+# In-process result cache: users retype/re-send near-identical drafts
+# within seconds, so identical (site, context, text) triples hit the
+# endpoint repeatedly. Serving repeats from memory skips the entire LLM
+# round-trip.
+_result_cache = TTLCache(maxsize=4096, ttl=300)
+_result_cache_lock = asyncio.Lock()
+
+def _result_cache_key(url: str, context: Any, text: str) -> bytes:
+  """Stable cache key over the site host, context and normalized text."""
+  if isinstance(context, dict):
+    context_label = json.dumps(context, sort_keys=True)
+  else:
+    context_label = str(context or "")
+  normalized_text = text.strip().casefold()
+  raw = f"{urlparse(url).netloc}|{context_label}|{normalized_text}"
+  return hashlib.blake2b(raw.encode(), digest_size=16).digest()
+
+# Server-side context cache for the static system prompt (Gemini only;
+# Gemma models don't support context caching). Caching the prompt on
+# Gemini's side means each request only sends the small JSON payload
+# instead of re-prefilling the multi-hundred-token prompt every time.
+_CONTEXT_CACHE_TTL_SECONDS = 3600
+_context_cache = None
+_context_cache_expiry = 0.0
+_gemini_model_instance = None
+
+async def _get_gemini_model(model_name):
+  """Return a Gemini model backed by a server-side cache of the system prompt.
+
+  The cache is created lazily and refreshed shortly before its TTL expires.
+  CachedContent.create is a synchronous network round-trip, so it runs in a
+  thread to keep the event loop free. Falls back to a plain GenerativeModel
+  with an inline system_instruction if context caching is unavailable for
+  this model or API key.
+  """
+  global _context_cache, _context_cache_expiry, _gemini_model_instance
+  now = time.monotonic()
+  if _gemini_model_instance is not None and now < _context_cache_expiry - 60:
+    return _gemini_model_instance
+
+  try:
+    _context_cache = await asyncio.to_thread(
+      genai.caching.CachedContent.create,
+      model=f"models/{model_name}",
+      system_instruction=REGRET_SYSTEM_PROMPT,
+      ttl=f"{_CONTEXT_CACHE_TTL_SECONDS}s",
+    )
+    _gemini_model_instance = genai.GenerativeModel.from_cached_content(
+      cached_content=_context_cache
+    )
+  except Exception as e:
+    logger.warning("Context caching unavailable (%s), using inline system prompt", e)
+    _context_cache = None
+    _gemini_model_instance = genai.GenerativeModel(
+      model_name=model_name,
+      system_instruction=REGRET_SYSTEM_PROMPT
+    )
+  # Either way, don't retry cache creation again until the TTL window passes
+  _context_cache_expiry = now + _CONTEXT_CACHE_TTL_SECONDS
+  return _gemini_model_instance
+
+# Shared generation configs, allocated once instead of per call.
+# Valid responses fit comfortably in ~120 tokens, so cap output at 150 per
+# item (decode is the slow, memory-bound phase) and generate
+# deterministically at temperature 0 so identical prompts produce
+# identical, cacheable outputs.
+_MAX_OUTPUT_TOKENS_PER_ITEM = 150
+
+# Structured-output schema: the model stops as soon as the object is
+# complete instead of over-generating (Gemini only)
+_RESPONSE_SCHEMA = {
+  "type": "object",
+  "properties": {
+    "regret_score": {"type": "integer"},
+    "reason": {"type": "string"},
+    "intervention_strength": {
+      "type": "string",
+      "enum": ["NONE", "WARN", "PUZZLE", "BLOCK_HARD"]
+    },
+    "llm_message": {"type": "string"},
+    "future_regret_simulation": {"type": "string"},
+  },
+  "required": ["regret_score", "reason", "intervention_strength", "llm_message"],
+  # Emit the verdict fields first: without this Gemini orders properties
+  # alphabetically, which would put future_regret_simulation (the longest
+  # field) ahead of regret_score and defeat the streaming early exit
+  "propertyOrdering": [
+    "regret_score",
+    "intervention_strength",
+    "reason",
+    "llm_message",
+    "future_regret_simulation",
+  ],
+}
+
+_GEMMA_GENERATION_CONFIG = {
+  # Gemma doesn't support JSON mode, so no response_mime_type
+  "temperature": 0.0,
+  "max_output_tokens": _MAX_OUTPUT_TOKENS_PER_ITEM
+}
+_GEMINI_GENERATION_CONFIG = {
+  "response_mime_type": "application/json",
+  "response_schema": _RESPONSE_SCHEMA,
+  "temperature": 0.0,
+  "max_output_tokens": _MAX_OUTPUT_TOKENS_PER_ITEM
+}
+
+@lru_cache(maxsize=4)
+def _model_setup(model_name):
+  """Memoized per-model prep: (is_gemma, generation_config, model instance).
+
+  Gemma models don't support system_instruction or JSON mode, so their
+  instance is built bare and memoized here. Gemini instances are returned
+  as None because _get_gemini_model manages them (context-cache TTL).
+  """
+  is_gemma = "gemma" in model_name.lower()
+  if is_gemma:
+    return is_gemma, _GEMMA_GENERATION_CONFIG, genai.GenerativeModel(model_name=model_name)
+  return is_gemma, _GEMINI_GENERATION_CONFIG, None
+
+# Dynamic batching: concurrent requests are collected for up to
+# _BATCH_WAIT_MS (or until _BATCH_MAX_SIZE items queue up) and sent to
+# Gemini as a single JSON-array prompt, amortizing per-call overhead and
+# network RTT across callers.
+_BATCH_MAX_SIZE = 8
+_BATCH_WAIT_MS = 20
+
+# Ceiling on how long a request waits for its batch slot to resolve;
+# comfortably above the worst-case retry schedule, so hitting it means the
+# future was lost (e.g. worker stranded on a dead loop) rather than slow
+_CLASSIFY_TIMEOUT_SECONDS = 60
+
+# Batched calls share one response, so the output cap scales with the
+# batch size and Gemini gets an array-of-objects schema
+_GEMMA_BATCH_GENERATION_CONFIG = dict(
+  _GEMMA_GENERATION_CONFIG,
+  max_output_tokens=_MAX_OUTPUT_TOKENS_PER_ITEM * _BATCH_MAX_SIZE,
+)
+_GEMINI_BATCH_GENERATION_CONFIG = dict(
+  _GEMINI_GENERATION_CONFIG,
+  response_schema={"type": "array", "items": _RESPONSE_SCHEMA},
+  max_output_tokens=_MAX_OUTPUT_TOKENS_PER_ITEM * _BATCH_MAX_SIZE,
+)
+_batch_queue = None
+_batch_worker_task = None
+_batch_loop = None
+
+_BATCH_INSTRUCTION = (
+  "You will receive a JSON array of independent user inputs. "
+  "Classify each one separately and return a JSON array with exactly one "
+  "result object per input, in the same order.\n"
+)
+
+# Prompt prefixes concatenated once at import time so each request only
+# pays for one prefix + payload concatenation instead of rebuilding the
+# ~1KB constant part per call
+def _gemma_prompt_prefix(shape):
+  return (
+    f"{REGRET_SYSTEM_PROMPT}\n\nIMPORTANT: You must respond with ONLY a valid JSON {shape}, "
+    "no other text. Each object must have these exact keys: regret_score (int), "
+    "reason (string), intervention_strength (string), llm_message (string), "
+    "future_regret_simulation (string).\n\nUser input:\n"
+  )
+
+_GEMMA_PREFIX_SINGLE = _gemma_prompt_prefix("object")
+_GEMMA_PREFIX_BATCH = _gemma_prompt_prefix("array of objects (one per input, same order)")
+
+def _build_user_content(user_prompts, is_gemma_model):
+  """Build the model input for one or more user payloads."""
+  # Minified JSON (not the Python dict repr): fewer prompt tokens and a
+  # format the model can parse unambiguously
+  if len(user_prompts) == 1:
+    payload_str = orjson.dumps(user_prompts[0]).decode()
+    prefix = _GEMMA_PREFIX_SINGLE
+  else:
+    payload_str = _BATCH_INSTRUCTION + orjson.dumps(user_prompts).decode()
+    prefix = _GEMMA_PREFIX_BATCH
+
+  if is_gemma_model:
+    # For Gemma: the system prompt travels in the user content
+    return prefix + payload_str
+  return payload_str
+
+async def _ensure_loop_state():
+  """Start the batching task lazily and keep loop-bound state current.
+
+  A worker started on a previous, now-dead event loop (its task never
+  reports done) can't serve this loop's requests, and asyncio primitives
+  bind to the loop they first run on - so the worker, its queue, the
+  result-cache lock and the Gemini semaphore are all recreated whenever
+  the running loop changes.
+  """
+  global _batch_queue, _batch_worker_task, _batch_loop
+  global _result_cache_lock, _gemini_semaphore
+  loop = asyncio.get_running_loop()
+  if (
+    _batch_worker_task is None
+    or _batch_worker_task.done()
+    or _batch_loop is not loop
+  ):
+    if _batch_queue is None or _batch_loop is not loop:
+      _batch_queue = asyncio.Queue()
+    if _batch_loop is not None and _batch_loop is not loop:
+      _result_cache_lock = asyncio.Lock()
+      _gemini_semaphore = asyncio.Semaphore(_GEMINI_CONCURRENCY)
+    _batch_loop = loop
+    _batch_worker_task = loop.create_task(_batch_worker())
+
+# Keep strong references to dispatched batch tasks so they aren't GC'd
+_inflight_batches = set()
+
+async def _batch_worker():
+  while True:
+    item = await _batch_queue.get()
+    batch = [item]
+    deadline = time.monotonic() + _BATCH_WAIT_MS / 1000.0
+    while len(batch) < _BATCH_MAX_SIZE:
+      remaining = deadline - time.monotonic()
+      if remaining <= 0:
+        break
+      try:
+        batch.append(await asyncio.wait_for(_batch_queue.get(), timeout=remaining))
+      except asyncio.TimeoutError:
+        break
+
+    # Dispatch without awaiting so the drain loop keeps collecting while
+    # earlier batches (including their retries/backoff) are in flight;
+    # _gemini_semaphore bounds the number of concurrent Gemini calls
+    task = asyncio.get_running_loop().create_task(_run_batch(batch))
+    _inflight_batches.add(task)
+    task.add_done_callback(_inflight_batches.discard)
+
+async def _run_batch(batch):
+  user_prompts = [prompt for prompt, _ in batch]
+  try:
+    results = await _generate_batch(user_prompts)
+  except Exception as e:
+    for _, future in batch:
+      if not future.done():
+        future.set_exception(e)
+    return
+  for (_, future), item_result in zip(batch, results):
+    if not future.done():
+      future.set_result(item_result)
+
+async def _generate_batch(user_prompts):
+  """Call Gemini once for a batch of payloads.
+
+  Returns a list of (data, llm_ok) tuples, one per input. Raises if no
+  model could produce a response at all.
+  """
+  global _cached_model_name, _gemini_model_instance
+
+  # Try models in order until one works. Once a model has succeeded we
+  # only try that one (with its cached instance) unless it starts 404ing.
+  last_error = None
+  response_text = None
+  early_results = None
+
+  if _cached_model_name:
+    model_names = [_cached_model_name] + [m for m in AVAILABLE_MODELS if m != _cached_model_name]
+  else:
+    model_names = AVAILABLE_MODELS
+
+  for model_name in model_names:
+    try:
+      # Jittered exponential backoff desynchronizes retries from
+      # concurrent requests so 429 storms don't thunder-herd the API;
+      # not-found errors are not retried and fall through to the next model
+      async for attempt in AsyncRetrying(
+        retry=retry_if_exception(_is_retryable_error),
+        wait=wait_exponential_jitter(initial=0.5, max=8),
+        stop=stop_after_attempt(_MAX_RETRIES),
+        before_sleep=_make_retry_logger(model_name),
+        reraise=True,
+      ):
+        with attempt:
+          is_gemma_model, generation_config, model = _model_setup(model_name)
+          if len(user_prompts) > 1:
+            generation_config = (
+              _GEMMA_BATCH_GENERATION_CONFIG if is_gemma_model
+              else _GEMINI_BATCH_GENERATION_CONFIG
+            )
+          if model is None:
+            # For Gemini: the system prompt lives in a server-side context
+            # cache (with inline fallback), so only the payload is sent
+            model = await _get_gemini_model(model_name)
+
+          user_content = _build_user_content(user_prompts, is_gemma_model)
+
+          # Generate content without blocking the event loop, gated by the
+          # concurrency semaphore. Single-payload calls stream so
+          # clearly-safe drafts return before the simulation text finishes
+          # decoding; batched calls need the whole array anyway.
+          async with _gemini_semaphore:
+            if len(user_prompts) == 1:
+              response_text, early_data = await _stream_single_response(
+                model, user_content, generation_config
+              )
+              if early_data is not None:
+                early_results = [(early_data, True)]
+            else:
+              response = await model.generate_content_async(
+                user_content,
+                generation_config=generation_config
+              )
+              response_text = response.text if hasattr(response, 'text') else str(response)
+
+      # Success! Pin this model name for future requests
+      if not _cached_model_name:
+        _cached_model_name = model_name
+        logger.info("Successfully using model: %s", model_name)
+      break  # Exit model loop on success
+
+    except Exception as e:
+      last_error = e
+
+      # If it's a 404 or model not found error, try next model
+      if _is_not_found_error(e):
+        logger.warning("Model %s not available, trying next...", model_name)
+        # Invalidate the cache if the pinned model disappeared
+        if model_name == _cached_model_name:
+          _cached_model_name = None
+        if "gemma" not in model_name.lower():
+          _gemini_model_instance = None
+        continue
+      # Retries exhausted on a live model - give up rather than burning
+      # the remaining fallbacks too
+      raise
+
+  # If we exhausted all models without success, raise the last error
+  if response_text is None and early_results is None:
+    if last_error:
+      raise last_error
+    else:
+      raise Exception("Failed to generate response from any available model")
+
+  if early_results is not None:
+    return early_results
+  return _parse_batch_response(response_text, len(user_prompts))
+
+# Streaming early exit: the verdict fields come first in the response, so
+# once a partially streamed object shows a clearly-safe score we can stop
+# decoding before the (longest) simulation field is generated.
+_EARLY_EXIT_SCORE = 20
+# The trailing delimiter guarantees the integer is complete: without it a
+# chunk boundary after "regret_score": 2 (of 25) would look like a safe 2
+_SCORE_RE = re.compile(r'"regret_score"\s*:\s*(\d+)\s*[,}]')
+_STRENGTH_RE = re.compile(r'"intervention_strength"\s*:\s*"(\w+)"')
+_REASON_RE = re.compile(r'"reason"\s*:\s*"((?:[^"\\]|\\.)*)"')
+_MESSAGE_RE = re.compile(r'"llm_message"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+def _unescape_json_string(escaped):
+  """Decode a JSON string body captured by regex (\\\" , \\n etc.)."""
+  try:
+    return json.loads(f'"{escaped}"')
+  except json.JSONDecodeError:
+    return escaped
+
+def _try_early_verdict(buffer):
+  """Extract a safe verdict from a partially streamed response, if possible.
+
+  Returns a data dict when both regret_score and intervention_strength have
+  been streamed and the score is below the early-exit threshold; otherwise
+  None (keep streaming).
+  """
+  score_match = _SCORE_RE.search(buffer)
+  strength_match = _STRENGTH_RE.search(buffer)
+  if not score_match or not strength_match:
+    return None
+  score = int(score_match.group(1))
+  if score >= _EARLY_EXIT_SCORE:
+    return None  # risky draft: stream the full reason/simulation
+
+  data = {
+    "regret_score": score,
+    "intervention_strength": strength_match.group(1),
+    "future_regret_simulation": "",
+  }
+  reason_match = _REASON_RE.search(buffer)
+  if reason_match:
+    data["reason"] = _unescape_json_string(reason_match.group(1))
+  message_match = _MESSAGE_RE.search(buffer)
+  if message_match:
+    data["llm_message"] = _unescape_json_string(message_match.group(1))
+  return data
+
+async def _stream_single_response(model, user_content, generation_config):
+  """Stream a single-payload response, exiting early for safe drafts.
+
+  Returns (response_text, early_data): early_data is a verdict dict when
+  the stream was cut short, otherwise None with the full response text.
+  """
+  response = await model.generate_content_async(
+    user_content,
+    generation_config=generation_config,
+    stream=True
+  )
+  stream = response.__aiter__()
+  buffer = ""
+  async for chunk in stream:
+    try:
+      chunk_text = chunk.text
+    except (ValueError, AttributeError):
+      continue
+    buffer += chunk_text
+    early_data = _try_early_verdict(buffer)
+    if early_data is not None:
+      # Safe draft: cancel the stream (mostly simulation tokens left)
+      # rather than leaving it open until GC, and answer now
+      aclose = getattr(stream, "aclose", None)
+      if aclose is not None:
+        try:
+          await aclose()
+        except Exception:
+          logger.debug("Failed to close early-exited stream", exc_info=True)
+      return buffer, early_data
+  return buffer, None
+
+# Compiled once: markdown-fence stripping and a C-speed JSON scanner.
+# raw_decode finds the first complete JSON value in one pass instead of
+# the old Python-level brace-counting loop.
+_MD_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$")
+_json_decoder = json.JSONDecoder()
+
+def _parse_batch_response(response_text, n):
+  """Parse a model response's text into n (data, llm_ok) tuples."""
+  raw_text = response_text
+  try:
+    # For Gemma models, the response might be wrapped in markdown code blocks or have extra text
+    response_text = _MD_FENCE_RE.sub('', response_text.strip())
+
+    if n > 1:
+      # Batched call: decode the first JSON array in the response
+      parsed, _ = _json_decoder.raw_decode(response_text, response_text.index('['))
+      if not isinstance(parsed, list) or len(parsed) != n:
+        raise ValueError(f"Expected a JSON array of {n} objects, got {type(parsed).__name__}")
+      return [(item, True) for item in parsed]
+
+    # Single payload: decode the first JSON object in the response
+    data, _ = _json_decoder.raw_decode(response_text, response_text.index('{'))
+    return [(data, True)]
+  except (json.JSONDecodeError, AttributeError, ValueError) as e:
+    logger.warning("JSON parsing error: %s", e)
+    logger.debug("Response text: %s", raw_text)
+    # Fallback if JSON parsing fails
+    fallback = {"regret_score": 0, "reason": "Failed to parse response.", "intervention_strength": "NONE", "llm_message": "Error occurred.", "future_regret_simulation": ""}
+    return [(dict(fallback), False) for _ in range(n)]
+
+@lru_cache(maxsize=256)
+def _hour_from_iso(prefix):
+  """Hour parsed from a YYYY-MM-DDTHH timestamp prefix, or None on bad input.
+
+  ciso8601 handles truncated timestamps (and trailing Z) natively and
+  parses in C; the lru_cache turns hot timestamps into a dict lookup.
+  """
+  try:
+    return ciso8601.parse_datetime(prefix).hour
+  except Exception:
+    return None
+
+async def classify_regret_async(payload: Dict[str, Any]) -> Dict[str, Any]:
   url = payload.get("url", "")
   text = payload.get("typed_text", "")
   time_iso = payload.get("time_iso")
   context = payload.get("context", {})
 
-  # crude time interpretation
-  hour = None
-  if time_iso:
-    try:
-      dt = datetime.fromisoformat(time_iso.replace("Z", "+00:00"))
-      hour = dt.hour
-    except Exception:
-      hour = None
+  # Refresh loop-bound state (worker, queue, lock, semaphore) before any
+  # of it is awaited on
+  await _ensure_loop_state()
+
+  # Serve repeated drafts straight from the result cache
+  cache_key = _result_cache_key(url, context, text)
+  async with _result_cache_lock:
+    cached_result = _result_cache.get(cache_key)
+  if cached_result is not None:
+    return cached_result
+
+  # crude time interpretation; only the hour matters, so parse the
+  # YYYY-MM-DDTHH prefix and let nearby requests share the cached result
+  hour = _hour_from_iso(time_iso[:13]) if time_iso else None
 
   user_prompt = {
     "url": url,
@@ -91,142 +593,17 @@ def classify_regret(payload: Dict[str, Any]) -> Dict[str, Any]:
     "context": context,
   }
 
+  llm_ok = False
   try:
-    global _cached_model_name
-    import time
-    
-    # Try models in order until one works
-    last_error = None
-    response = None
-    max_retries = 3
-    retry_delay = 1  # seconds
-    
-    for model_name in AVAILABLE_MODELS:
-      for attempt in range(max_retries):
-        try:
-          # Gemma models don't support system_instruction or JSON mode
-          # For Gemini models, we can use both
-          is_gemma_model = "gemma" in model_name.lower()
-          
-          if is_gemma_model:
-            # For Gemma: include system prompt in the user content and request JSON format
-            model = genai.GenerativeModel(model_name=model_name)
-            # Add explicit JSON format request to the prompt
-            gemma_prompt = f"{REGRET_SYSTEM_PROMPT}\n\nIMPORTANT: You must respond with ONLY a valid JSON object, no other text. The JSON must have these exact keys: regret_score (int), reason (string), intervention_strength (string), llm_message (string), future_regret_simulation (string).\n\nUser input:\n{user_prompt}"
-            user_content = gemma_prompt
-            # Gemma doesn't support JSON mode, so we don't use response_mime_type
-            generation_config = {
-              "temperature": 0.7,
-              "max_output_tokens": 500
-            }
-          else:
-            # For Gemini: use system_instruction parameter and JSON mode
-            model = genai.GenerativeModel(
-              model_name=model_name,
-              system_instruction=REGRET_SYSTEM_PROMPT
-            )
-            user_content = f"{user_prompt}"
-            generation_config = {
-              "response_mime_type": "application/json",
-              "temperature": 0.7,
-              "max_output_tokens": 500
-            }
-          
-          # Generate content
-          response = model.generate_content(
-            user_content,
-            generation_config=generation_config
-          )
-          
-          # Success! Cache this model name
-          if not _cached_model_name:
-            _cached_model_name = model_name
-            print(f"[RegretGPT] Successfully using model: {model_name}")
-          break  # Exit the retry loop on success
-          
-        except Exception as e:
-          last_error = e
-          error_str = str(e)
-          
-          # If it's a 404 or model not found error, try next model
-          if "404" in error_str or "not found" in error_str.lower() or "not supported" in error_str.lower():
-            print(f"[RegretGPT] Model {model_name} not available, trying next...")
-            break  # Break retry loop, try next model
-          elif "429" in error_str or "quota" in error_str.lower() or "rate limit" in error_str.lower():
-            # Rate limit - retry with backoff
-            if attempt < max_retries - 1:
-              wait_time = retry_delay * (2 ** attempt)
-              print(f"[RegretGPT] Rate limited, retrying in {wait_time}s...")
-              time.sleep(wait_time)
-              continue
-            else:
-              raise
-          else:
-            # Other errors - retry if not last attempt
-            if attempt < max_retries - 1:
-              print(f"[RegretGPT] Error (attempt {attempt + 1}/{max_retries}): {error_str}, retrying...")
-              time.sleep(retry_delay)
-              continue
-            else:
-              raise
-      
-      if response is not None:
-        break  # Exit model loop on success
-    
-    # If we exhausted all models without success, raise the last error
-    if response is None:
-      if last_error:
-        raise last_error
-      else:
-        raise Exception("Failed to generate response from any available model")
-
-    # Parse the response
-    if response is None:
-      raise Exception("No response received from model")
-      
-    try:
-      response_text = response.text if hasattr(response, 'text') else str(response)
-      
-      # For Gemma models, the response might be wrapped in markdown code blocks or have extra text
-      # Try to extract JSON from the response
-      
-      # Clean up common markdown formatting first
-      response_text = response_text.strip()
-      if response_text.startswith('```json'):
-        response_text = response_text[7:].strip()
-      elif response_text.startswith('```'):
-        response_text = response_text[3:].strip()
-      if response_text.endswith('```'):
-        response_text = response_text[:-3].strip()
-      
-      # Try to find JSON object in the response (better handling of nested objects)
-      # Look for the first { and try to find matching }
-      start_idx = response_text.find('{')
-      if start_idx != -1:
-        # Count braces to find the matching closing brace
-        brace_count = 0
-        end_idx = start_idx
-        for i in range(start_idx, len(response_text)):
-          if response_text[i] == '{':
-            brace_count += 1
-          elif response_text[i] == '}':
-            brace_count -= 1
-            if brace_count == 0:
-              end_idx = i
-              break
-        if brace_count == 0:
-          response_text = response_text[start_idx:end_idx + 1]
-      
-      data = json.loads(response_text)
-    except (json.JSONDecodeError, AttributeError) as e:
-      print(f"JSON parsing error: {e}")
-      print(f"Response text: {response.text if hasattr(response, 'text') else 'No text attribute'}")
-      # Fallback if JSON parsing fails
-      data = {"regret_score": 0, "reason": "Failed to parse response.", "intervention_strength": "NONE", "llm_message": "Error occurred.", "future_regret_simulation": ""}
+    # Hand the payload to the batching worker and wait for our slot in
+    # the next Gemini call
+    future = asyncio.get_running_loop().create_future()
+    await _batch_queue.put((user_prompt, future))
+    # Bounded wait: a lost future degrades into the safe-default error
+    # path below instead of hanging the request forever
+    data, llm_ok = await asyncio.wait_for(future, timeout=_CLASSIFY_TIMEOUT_SECONDS)
   except Exception as e:
-    print(f"Error calling Gemini API: {e}")
-    import traceback
-    traceback.print_exc()
+    logger.exception("Error calling Gemini API: %s", e)
     # Return safe default on API error
     data = {"regret_score": 0, "reason": f"API error: {str(e)}", "intervention_strength": "NONE", "llm_message": "API error occurred.", "future_regret_simulation": ""}
 
@@ -237,10 +614,17 @@ def classify_regret(payload: Dict[str, Any]) -> Dict[str, Any]:
   llm_msg = data.get("llm_message", "You sure about this?")
   sim = data.get("future_regret_simulation", "")
 
-  return {
+  result = {
     "regret_score": regret_score,
     "reason": reason,
     "intervention_strength": strength,
     "llm_message": llm_msg,
     "simulation": sim,
   }
+
+  # Only cache genuine LLM verdicts, never error fallbacks
+  if llm_ok:
+    async with _result_cache_lock:
+      _result_cache[cache_key] = result
+
+  return result